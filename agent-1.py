@@ -1,30 +1,27 @@
 # Standard library imports
 import os
-import time
 
 # Third-party imports
 from dotenv import load_dotenv
 
-# LangChain imports
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-
 # Google Gemini imports
 from langchain_google_genai import ChatGoogleGenerativeAI
 
 # Local imports
-from db.database import add_message, get_last_messages, create_table
-from logger import (
-    setup_logger, log_session_start, log_session_end, log_user_input, 
-    log_api_call_start, log_successful_response, log_error, log_debug,
-    print_welcome_message, print_user_message, print_bot_message, 
-    print_goodbye, print_thinking, print_typing_indicator
-)
-from helper import convert_db_messages_to_langchain, format_error_message, handle_error
+from db.database import create_table
+from logger import setup_logger
+from context_cache import ContextCache, GeminiCachedContentProvider
+from request_coalescer import RequestCoalescer
+from agent_runner import AgentBranch, DatabaseMemory, run_chat
 
 # Initialize database - create/update table if it doesn't exist
 create_table()
 
-max_remember_messages = 5
+# Context window - between max_remember_messages - remember_block_size and max_remember_messages
+# of the most recent rows are sent, advancing in blocks so the start of the context stays
+# stable for context caching
+max_remember_messages = 10
+remember_block_size = 5
 
 # Load environment variables
 load_dotenv()
@@ -39,84 +36,30 @@ llm = ChatGoogleGenerativeAI(
     temperature=0.7
 )
 
+# Request coalescing - identical in-flight prompts share one upstream call
+coalescer = RequestCoalescer(llm)
+
+# Context caching - reuse the stable prompt prefix across turns (set USE_CONTEXT_CACHE=true)
+use_context_cache = os.getenv("USE_CONTEXT_CACHE", "false").lower() == "true"
+context_cache = ContextCache(
+    coalescer,
+    GeminiCachedContentProvider("gemini-2.5-flash", os.getenv("GOOGLE_API_KEY")) if use_context_cache else None,
+    logger=logger
+)
+
 # System prompt - customize this to change the bot's behavior
 SYSTEM_PROMPT = "You are a helpful and friendly assistant. Answer questions clearly and concisely."
 
+# Agent - history is the last messages saved to the database by this agent (agent_type 'agent1')
+agent = AgentBranch(
+    'agent1', coalescer, SYSTEM_PROMPT,
+    memory=DatabaseMemory('agent1', max_remember_messages, remember_block_size),
+    context_cache=context_cache
+)
+
 # Main function
 def main():
-    log_session_start(logger)
-    print_welcome_message("Chatbot with Database Memory")
-    
-    while True:
-        from logger import Colors, print_separator
-        user_input = input(f"{Colors.BLUE}👤 You: {Colors.RESET}").strip()
-        
-        if not user_input:
-            continue
-        
-        if user_input.lower() in ['exit', 'quit', 'bye']:
-            log_session_end(logger)
-            print_goodbye()
-            break
-        
-        # Print separator line after user input
-        print_separator(Colors.BLUE)
-        print()  # Empty line after separator
-        
-        # Log user input
-        log_user_input(logger, user_input)
-        start_time = time.time()
-        
-        try:
-            # Show thinking indicator
-            print_thinking()
-            
-            # Get last messages from database for context
-            log_debug(logger, "Retrieving messages from database...")
-            db_messages = get_last_messages(max_remember_messages)
-            log_debug(logger, f"Retrieved {len(db_messages)} messages from database")
-            
-            # Convert database messages to LangChain format (without system prompt)
-            langchain_messages = convert_db_messages_to_langchain(db_messages)
-            
-            # Add current user message
-            langchain_messages.append(HumanMessage(content=user_input))
-            
-            # Add system prompt at the beginning
-            langchain_messages = [SystemMessage(content=SYSTEM_PROMPT)] + langchain_messages
-            
-            log_debug(logger, f"Total messages for context: {len(langchain_messages)}")
-            
-            # Invoke LLM with conversation history
-            log_api_call_start(logger)
-            response = llm.invoke(langchain_messages)
-            elapsed_time = time.time() - start_time
-            
-            # Save message to database (function handles tokens, cost, datetime, and agent_type)
-            log_debug(logger, "Saving messages to database...")
-            add_message(
-                message=user_input,
-                response_text=response.content,
-                agent_type='agent1',
-                llm=llm,
-                messages=langchain_messages,
-                response_obj=response
-            )
-            
-            # Log successful response
-            log_successful_response(logger, response.content, elapsed_time)
-            
-            # Clear thinking indicator and show typing indicator right before displaying the message
-            from logger import clear_thinking
-            clear_thinking()
-            print_typing_indicator()
-            
-            # Print bot response with nice formatting
-            print_bot_message(response.content, elapsed_time)
-        except Exception as e:
-            elapsed_time = time.time() - start_time
-            if handle_error(e, logger, elapsed_time):
-                break
+    run_chat("Chatbot with Database Memory", [agent], logger)
 
 if __name__ == "__main__":
     main()
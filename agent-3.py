@@ -0,0 +1,67 @@
+# Standard library imports
+import os
+
+# Third-party imports
+from dotenv import load_dotenv
+
+# Google Gemini imports
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+# Local imports
+from db.database import create_table
+from logger import setup_logger
+from request_coalescer import RequestCoalescer
+from session_store import SessionStore
+from agent_runner import AgentBranch, DatabaseMemory, SessionMemory, check_strategy, run_chat
+
+# Initialize database - create/update table if it doesn't exist
+create_table()
+
+# Load environment variables
+load_dotenv()
+
+# Setup logger
+logger = setup_logger('agent3')
+
+def create_llm(temperature: float):
+    """Create a Gemini Flash model behind a request coalescer."""
+    return RequestCoalescer(ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash",
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        temperature=temperature
+    ))
+
+# Session store for the in-memory branch (restored on restart, see agent-2; its own log file
+# so agent-2 and agent-3 can run at the same time)
+session_store = SessionStore('db/agent3_sessions.log', max_memory_bytes=32 * 1024 * 1024, max_hot_messages=40)
+
+# Agents answering each turn concurrently, each with its own memory - customize prompts, models and timeouts here.
+# Every branch is saved to the database under its own agent_type (agent-1 only reads 'agent1' rows).
+BRANCHES = [
+    AgentBranch(
+        'agent3-db', create_llm(0.3),
+        "You are a helpful and friendly assistant. Answer questions clearly and concisely.",
+        memory=DatabaseMemory('agent3-db', max_remember_messages=5),
+        timeout_seconds=30.0
+    ),
+    AgentBranch(
+        'agent3-memory', create_llm(0.7),
+        "You are a helpful and knowledgeable assistant. Answer questions accurately, with a short explanation.",
+        memory=SessionMemory(session_store.history(os.getenv("SESSION_ID", "default")), 40, 20),
+        timeout_seconds=30.0
+    ),
+]
+
+# How the answer is chosen: 'first-good', 'vote' (short or closed-form answers only) or 'judge'
+STRATEGY = os.getenv("AGENT_STRATEGY", "first-good")
+judge_llm = create_llm(0.0)
+
+# Fail at startup on an invalid AGENT_STRATEGY rather than on the first turn
+check_strategy(STRATEGY, judge_llm)
+
+# Main function
+def main():
+    run_chat(f"Multi-Agent Chatbot ({STRATEGY})", BRANCHES, logger, strategy=STRATEGY, judge_llm=judge_llm)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+# Standard library imports
+import math
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional
+
+# LangChain imports
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# Local imports
+from db.database import add_message, count_selected_messages, get_last_selected_messages, set_selected_response
+from helper import convert_db_messages_to_langchain, format_error_message, get_block_window_size, handle_error
+from logger import (
+    log_session_start, log_session_end, log_user_input, log_api_call_start,
+    log_successful_response, log_debug, print_welcome_message, print_bot_message,
+    print_goodbye, print_thinking, print_typing_indicator
+)
+from metrics import ERRORS, record_token_usage, start_metrics_from_env
+from tokens_counter import get_token_counts_with_cost
+
+STRATEGIES = ('first-good', 'vote', 'judge')
+
+# Answers at least this similar (after normalization) count as the same vote
+VOTE_SIMILARITY = 0.8
+
+JUDGE_PROMPT = (
+    "You are judging answers from several assistants to the same question. "
+    "Reply with the number of the best answer only."
+)
+
+
+class DatabaseMemory:
+    """
+    Conversation memory read from the agent's own rows in the messages table (agent-1).
+
+    History is the user message plus the answer shown to the user
+    (`selected_response`) of rows with this agent_type; rows that only
+    record usage (e.g. a late agent-3 branch) have no selected response.
+    """
+
+    def __init__(self, agent_type: str, max_remember_messages: int = 5, block_size: Optional[int] = None):
+        """
+        Args:
+            agent_type: Only rows with this agent_type are used as history
+            max_remember_messages: Maximum number of recent rows to use as context
+            block_size: Number of rows the window start advances by at a time, so the
+                start of the context stays stable for context caching (None for a plain
+                window of the last max_remember_messages rows)
+        """
+        self.agent_type = agent_type
+        self.max_remember_messages = max_remember_messages
+        self.block_size = block_size
+        self._lock = threading.Lock()
+
+    def load(self) -> List[BaseMessage]:
+        """Return the recent history (without system prompt)."""
+        limit = self.max_remember_messages
+        if self.block_size:
+            limit = get_block_window_size(count_selected_messages(self.agent_type), limit, self.block_size)
+        if limit == 0:
+            return []
+        db_messages = get_last_selected_messages(limit, self.agent_type)
+        return convert_db_messages_to_langchain(db_messages)
+
+    def save(self, user_input: str, selected_response: str, message_id: Optional[int] = None):
+        """
+        Add the turn's selected answer to the history.
+
+        Args:
+            user_input: User message of the turn
+            selected_response: Answer shown to the user
+            message_id: This branch's messages row for the turn (None if it didn't answer in time)
+        """
+        with self._lock:
+            if message_id is not None:
+                set_selected_response(message_id, selected_response)
+            else:
+                # No usage row to attach it to: save a history-only row (no tokens, no cost)
+                add_message(user_input, None, agent_type=self.agent_type, selected_response=selected_response)
+
+
+class SessionMemory:
+    """Conversation memory in a SessionStore session (agent-2)."""
+
+    def __init__(self, history, max_remember_messages: int = 40, block_size: int = 20):
+        """
+        Args:
+            history: SessionChatMessageHistory of the session
+            max_remember_messages: Maximum number of recent messages to use as context
+            block_size: Number of messages the window start advances by at a time
+        """
+        self.history = history
+        self.max_remember_messages = max_remember_messages
+        self.block_size = block_size
+        self._lock = threading.Lock()
+
+    def load(self) -> List[BaseMessage]:
+        """Return the recent history (without system prompt)."""
+        # Read only the window, not the whole session
+        size = get_block_window_size(self.history.message_count(), self.max_remember_messages, self.block_size)
+        return self.history.last_messages(size)
+
+    def save(self, user_input: str, selected_response: str, message_id: Optional[int] = None):
+        """
+        Add the turn's selected answer to the history.
+
+        Args:
+            user_input: User message of the turn
+            selected_response: Answer shown to the user
+            message_id: Unused (the history doesn't live in the messages table)
+        """
+        with self._lock:
+            self.history.add_messages([HumanMessage(content=user_input), AIMessage(content=selected_response)])
+
+
+class AgentBranch:
+    """One agent (model, system prompt, memory) answering a turn."""
+
+    def __init__(self, agent_type: str, llm, system_prompt: str, memory=None, record: bool = True,
+                 timeout_seconds: Optional[float] = None, context_cache=None):
+        """
+        Args:
+            agent_type: Name recorded in the messages table for this branch
+            llm: LLM instance (anything with invoke(messages))
+            system_prompt: System prompt for this branch
+            memory: DatabaseMemory, SessionMemory, or None for no history
+            record: Save each answer to the messages table (otherwise only metrics)
+            timeout_seconds: Answers arriving later than this are ignored: not shown and not
+                added to memory, only their usage is recorded (None for no timeout)
+            context_cache: Optional ContextCache wrapping llm, used to invoke it
+        """
+        if isinstance(memory, DatabaseMemory) and not record:
+            raise ValueError("DatabaseMemory reads the branch's own rows, so the branch must be recorded")
+        self.agent_type = agent_type
+        self.llm = llm
+        self.system_prompt = system_prompt
+        self.memory = memory
+        self.record = record
+        self.timeout_seconds = timeout_seconds
+        self.context_cache = context_cache
+
+
+def _run_branch(branch: AgentBranch, user_input: str) -> Dict[str, Any]:
+    """
+    Run one branch: build its context, invoke it, and record tokens and cost.
+
+    Memory is not written here: run_turn saves the selected answer to every
+    branch once the turn is decided, so a late branch (still running after
+    the turn) can't add an answer the user never saw.
+
+    Never raises: errors are counted in the metrics and returned in the
+    'error' key so that one failing branch doesn't take down the turn.
+    """
+    start_time = time.time()
+    try:
+        history = branch.memory.load() if branch.memory else []
+        messages = [SystemMessage(content=branch.system_prompt)] + history + [HumanMessage(content=user_input)]
+
+        if branch.context_cache:
+            response, cached_input_tokens = branch.context_cache.invoke(messages)
+        else:
+            response, cached_input_tokens = branch.llm.invoke(messages), 0
+        elapsed_time = time.time() - start_time
+
+        if branch.record:
+            # add_message handles tokens, cost, metrics and agent_type
+            token_data = add_message(
+                message=user_input,
+                response_text=response.content,
+                agent_type=branch.agent_type,
+                llm=branch.llm,
+                messages=messages,
+                response_obj=response,
+                cached_input_tokens=cached_input_tokens
+            )
+        else:
+            token_data = get_token_counts_with_cost(branch.llm, messages, response, cached_input_tokens)
+            record_token_usage(token_data)
+
+        return {'agent_type': branch.agent_type, 'response': response.content, 'elapsed_time': elapsed_time,
+                'context_messages': len(messages), 'token_data': token_data, 'error': None}
+    except Exception as e:
+        ERRORS.inc(category=format_error_message(e))
+        return {'agent_type': branch.agent_type, 'response': None, 'elapsed_time': time.time() - start_time,
+                'context_messages': 0, 'token_data': None, 'error': e}
+
+
+def _failed_result(branch: AgentBranch, elapsed_time: float, error: Exception) -> Dict[str, Any]:
+    """Result for a branch that didn't answer in time."""
+    return {'agent_type': branch.agent_type, 'response': None, 'elapsed_time': elapsed_time,
+            'context_messages': 0, 'token_data': None, 'error': error}
+
+
+def check_strategy(strategy: str, judge_llm=None):
+    """
+    Validate an answer selection strategy.
+
+    Args:
+        strategy: 'first-good', 'vote' or 'judge'
+        judge_llm: LLM used by the 'judge' strategy
+
+    Raises:
+        ValueError: If the strategy is unknown, or 'judge' has no judge_llm
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {STRATEGIES}")
+    if strategy == 'judge' and judge_llm is None:
+        raise ValueError("The 'judge' strategy requires a judge_llm")
+
+
+def _normalize_answer(text: str) -> str:
+    """Normalize an answer for voting (case, punctuation and whitespace insensitive)."""
+    return " ".join(re.sub(r'[^\w\s]', ' ', str(text).lower()).split())
+
+
+def _select_by_vote(good_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Pick the answer the most answers agree with; ties go to the earliest branch.
+
+    Two answers agree when their normalized texts are at least VOTE_SIMILARITY
+    similar. This suits short or closed-form answers (a number, a name,
+    yes/no); long free-form answers from different prompts or temperatures
+    rarely agree, in which case every answer has one vote and the first
+    branch wins.
+    """
+    answers = [_normalize_answer(r['response']) for r in good_results]
+
+    def votes(index: int) -> int:
+        return sum(1 for other in answers if SequenceMatcher(None, answers[index], other).ratio() >= VOTE_SIMILARITY)
+
+    best = max(range(len(answers)), key=lambda i: (votes(i), -i))
+    return good_results[best]
+
+
+def _select_by_judge(good_results: List[Dict[str, Any]], user_input: str, judge_llm) -> Dict[str, Any]:
+    """Ask a judge LLM to pick the best answer; falls back to the first one."""
+    answers = "\n\n".join(f"Answer {i + 1}:\n{r['response']}" for i, r in enumerate(good_results))
+    judge_input = f"Question:\n{user_input}\n\n{answers}"
+    # The judge isn't a conversation: no memory and no messages row (tokens and cost go to the metrics)
+    judge_branch = AgentBranch('judge', judge_llm, JUDGE_PROMPT, record=False)
+    verdict = _run_branch(judge_branch, judge_input)
+    if verdict['error'] is None:
+        match = re.search(r'\d+', str(verdict['response']))
+        if match and 1 <= int(match.group()) <= len(good_results):
+            return good_results[int(match.group()) - 1]
+    return good_results[0]
+
+
+def run_turn(branches: List[AgentBranch], user_input: str, strategy: str = 'first-good',
+             judge_llm=None) -> Dict[str, Any]:
+    """
+    Run one turn against one or more agents concurrently and select an answer.
+
+    All branches start at once, so the turn takes about as long as the slowest
+    branch (or the fastest good one for 'first-good'). Each branch reads its own
+    memory and is recorded with its own agent_type, tokens and cost, including
+    branches that finish after the answer was selected. Once an answer is
+    selected it is saved to every branch's memory; late answers never are.
+    Branch failures and timeouts are counted in the error metrics here.
+
+    Args:
+        branches: Agents to run
+        user_input: Current user message
+        strategy: 'first-good' (fastest non-empty answer), 'vote' (answer most
+            others agree with, for short answers) or 'judge' (judge_llm picks the best answer)
+        judge_llm: LLM used by the 'judge' strategy
+
+    Returns:
+        Dictionary with 'agent_type', 'response', 'elapsed_time', and 'branches'
+        (one result per branch: 'agent_type', 'response', 'elapsed_time',
+        'context_messages', 'token_data', 'error')
+    """
+    check_strategy(strategy, judge_llm)
+
+    start_time = time.time()
+    executor = ThreadPoolExecutor(max_workers=len(branches))
+    futures = {executor.submit(_run_branch, b, user_input): b for b in branches}
+    deadlines = {
+        f: start_time + b.timeout_seconds if b.timeout_seconds is not None else math.inf
+        for f, b in futures.items()
+    }
+
+    results = []
+    selected = None
+    pending = set(futures)
+    timed_out = set()
+    while pending and selected is None:
+        # Give up on branches past their own timeout, wait for the rest
+        now = time.time()
+        expired = {f for f in pending if deadlines[f] <= now}
+        pending -= expired
+        timed_out |= expired
+        if not pending:
+            break
+        next_deadline = min(deadlines[f] for f in pending)
+        timeout = None if next_deadline == math.inf else next_deadline - now
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if result['error'] is None and start_time + result['elapsed_time'] > deadlines[future]:
+                result['error'] = TimeoutError(f"{result['agent_type']} answered after {result['elapsed_time']:.2f}s")
+                ERRORS.inc(category=format_error_message(result['error']))
+            results.append(result)
+            if selected is None and strategy == 'first-good' and result['error'] is None and result['response']:
+                selected = result
+
+    # Late branches keep running in the background and still record their usage
+    executor.shutdown(wait=False)
+    for future in timed_out:
+        branch = futures[future]
+        error = TimeoutError(f"{branch.agent_type} timed out after {branch.timeout_seconds:.2f}s")
+        ERRORS.inc(category=format_error_message(error))
+        results.append(_failed_result(branch, time.time() - start_time, error))
+    for future in pending:
+        branch = futures[future]
+        error = CancelledError(f"{branch.agent_type} not awaited after a good answer")
+        results.append(_failed_result(branch, time.time() - start_time, error))
+
+    # Keep branch results in configuration order
+    order = {b.agent_type: i for i, b in enumerate(branches)}
+    results.sort(key=lambda r: order[r['agent_type']])
+
+    good_results = [r for r in results if r['error'] is None and r['response']]
+    if selected is None:
+        if not good_results:
+            errors = [r['error'] for r in results if r['error'] is not None]
+            raise errors[0] if errors else RuntimeError("No agent returned an answer")
+        if strategy == 'vote':
+            selected = _select_by_vote(good_results)
+        elif strategy == 'judge':
+            selected = _select_by_judge(good_results, user_input, judge_llm)
+        else:
+            selected = good_results[0]
+
+    # Every branch remembers the answer the user saw (not its own), so follow-ups
+    # refer to the same text in every branch
+    for branch in branches:
+        if branch.memory:
+            result = next(r for r in results if r['agent_type'] == branch.agent_type)
+            message_id = (result['token_data'] or {}).get('message_id')
+            branch.memory.save(user_input, selected['response'], message_id)
+
+    return {
+        'agent_type': selected['agent_type'],
+        'response': selected['response'],
+        'elapsed_time': time.time() - start_time,
+        'branches': results
+    }
+
+
+def run_chat(title: str, branches: List[AgentBranch], logger, strategy: str = 'first-good', judge_llm=None):
+    """
+    Run the interactive chat loop shared by all agents.
+
+    Args:
+        title: Name shown in the welcome message
+        branches: Agents answering each turn (one for agent-1/agent-2, several for agent-3)
+        logger: Logger instance
+        strategy: How the answer is selected when there are several branches
+        judge_llm: LLM used by the 'judge' strategy
+    """
+    from logger import Colors, print_separator, clear_thinking
+
+    start_metrics_from_env(logger)
+    log_session_start(logger)
+    print_welcome_message(title)
+
+    while True:
+        user_input = input(f"{Colors.BLUE}👤 You: {Colors.RESET}").strip()
+
+        if not user_input:
+            continue
+
+        if user_input.lower() in ['exit', 'quit', 'bye']:
+            log_session_end(logger)
+            print_goodbye()
+            break
+
+        # Print separator line after user input
+        print_separator(Colors.BLUE)
+        print()  # Empty line after separator
+
+        # Log user input
+        log_user_input(logger, user_input)
+        start_time = time.time()
+
+        try:
+            # Show thinking indicator
+            print_thinking()
+
+            # Invoke the agent(s) with their conversation history
+            log_api_call_start(logger)
+            turn = run_turn(branches, user_input, strategy=strategy, judge_llm=judge_llm)
+            elapsed_time = time.time() - start_time
+
+            for branch in turn['branches']:
+                if branch['error'] is not None:
+                    log_debug(logger, f"{branch['agent_type']}: {type(branch['error']).__name__} after {branch['elapsed_time']:.2f}s")
+                    continue
+                token_data = branch['token_data']
+                log_debug(logger, f"{branch['agent_type']}: {branch['context_messages']} messages in context, "
+                                  f"answered in {branch['elapsed_time']:.2f}s")
+                log_debug(logger, f"Token usage - Input: {token_data['input_tokens']} (cached: {token_data['cached_input_tokens']}), "
+                                  f"Output: {token_data['output_tokens']}, Cost: {token_data['cost_formatted']}")
+            if len(branches) > 1:
+                log_debug(logger, f"Selected answer from {turn['agent_type']} ({strategy})")
+
+            # Log successful response
+            log_successful_response(logger, turn['response'], elapsed_time)
+
+            # Clear thinking indicator and show typing indicator right before displaying the message
+            clear_thinking()
+            print_typing_indicator()
+
+            # Print bot response with nice formatting
+            print_bot_message(turn['response'], elapsed_time)
+        except Exception as e:
+            elapsed_time = time.time() - start_time
+            # Branch errors were already counted in the metrics by run_turn
+            if handle_error(e, logger, elapsed_time, count_error=False):
+                break
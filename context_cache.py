@@ -0,0 +1,311 @@
+# Standard library imports
+import hashlib
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+# LangChain imports
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# Local imports
+from helper import get_block_window
+from metrics import record_cache_event
+from tokens_counter import estimate_tokens_from_messages
+
+# Gemini 2.5 Flash only accepts cached contents above this size
+MIN_CACHED_PREFIX_TOKENS = 1024
+
+# How long a registered prefix lives on the provider side
+DEFAULT_CACHE_TTL_SECONDS = 300
+
+
+class CachedContentNotFound(Exception):
+    """Raised when a cached content name is unknown or has expired."""
+
+
+def _fingerprint(message: BaseMessage) -> str:
+    """Return a stable fingerprint of a message (type + content)."""
+    payload = f"{message.type}\x00{message.content}"
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _common_prefix_length(first: List[str], second: List[str]) -> int:
+    """Return the number of leading fingerprints shared by both lists."""
+    length = 0
+    for a, b in zip(first, second):
+        if a != b:
+            break
+        length += 1
+    return length
+
+
+class LocalCachedContentProvider:
+    """
+    In-process stand-in for a provider's cached-content API.
+
+    Emulates the semantics of Gemini context caching (named, immutable
+    prefixes with a TTL that fail once expired) so the caching flow can be
+    exercised against fake models without network access. On invoke the
+    stored prefix is prepended to the delta, like the provider does server-side.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[List[BaseMessage], float]] = {}
+
+    def create(self, messages: List[BaseMessage], ttl_seconds: int = DEFAULT_CACHE_TTL_SECONDS) -> str:
+        """Register a prefix and return its cache name."""
+        name = f"cachedContents/local-{uuid.uuid4().hex[:12]}"
+        self._entries[name] = (list(messages), time.monotonic() + ttl_seconds)
+        return name
+
+    def get(self, name: str) -> List[BaseMessage]:
+        """Return the cached prefix, raising CachedContentNotFound if missing or expired."""
+        entry = self._entries.get(name)
+        if entry is None or entry[1] <= time.monotonic():
+            self._entries.pop(name, None)
+            raise CachedContentNotFound(name)
+        return entry[0]
+
+    def invoke(self, llm, name: str, delta: List[BaseMessage]):
+        """Invoke the model with the cached prefix followed by the delta."""
+        return llm.invoke(self.get(name) + list(delta))
+
+    def delete(self, name: str):
+        """Delete a cached prefix (no-op if it doesn't exist)."""
+        self._entries.pop(name, None)
+
+
+class GeminiCachedContentProvider:
+    """
+    Cached-content provider backed by the Gemini context caching API.
+
+    Requires the `google-genai` package.
+    """
+
+    def __init__(self, model: str, api_key: Optional[str] = None):
+        from google import genai
+        from google.genai import types
+
+        self.model = model
+        self.client = genai.Client(api_key=api_key)
+        self.types = types
+
+    def create(self, messages: List[BaseMessage], ttl_seconds: int = DEFAULT_CACHE_TTL_SECONDS) -> str:
+        """Register a prefix with Gemini and return its cache name."""
+        system_instruction = "\n".join(
+            str(m.content) for m in messages if isinstance(m, SystemMessage)
+        )
+        contents = [
+            self.types.Content(
+                role='model' if isinstance(m, AIMessage) else 'user',
+                parts=[self.types.Part(text=str(m.content))]
+            )
+            for m in messages if not isinstance(m, SystemMessage)
+        ]
+        cache = self.client.caches.create(
+            model=self.model,
+            config=self.types.CreateCachedContentConfig(
+                system_instruction=system_instruction or None,
+                contents=contents,
+                ttl=f"{ttl_seconds}s"
+            )
+        )
+        return cache.name
+
+    def invoke(self, llm, name: str, delta: List[BaseMessage]):
+        """Invoke the model with only the delta, referencing the cached prefix."""
+        try:
+            return llm.invoke(delta, cached_content=name)
+        except Exception as e:
+            if "NOT_FOUND" in str(e) or "404" in str(e):
+                raise CachedContentNotFound(name) from e
+            raise
+
+    def delete(self, name: str):
+        """Delete a cached prefix on the provider side."""
+        self.client.caches.delete(name=name)
+
+
+class ContextCache:
+    """
+    Reuse a stable prompt prefix (system prompt plus older turns) across turns.
+
+    The prefix shared with the previous request is registered with the
+    provider once it is large enough to be cached; subsequent turns send only
+    the messages after it. The cached prefix is re-registered when the
+    uncached delta grows past `refresh_tokens`, when it expires, or when the
+    history no longer starts with it.
+
+    With no provider configured every call is a plain `llm.invoke`.
+    """
+
+    def __init__(self, llm, provider=None, min_prefix_tokens: int = MIN_CACHED_PREFIX_TOKENS,
+                 refresh_tokens: int = MIN_CACHED_PREFIX_TOKENS,
+                 ttl_seconds: int = DEFAULT_CACHE_TTL_SECONDS, logger=None):
+        self.llm = llm
+        self.provider = provider
+        self.min_prefix_tokens = min_prefix_tokens
+        self.refresh_tokens = refresh_tokens
+        self.ttl_seconds = ttl_seconds
+        self.logger = logger
+
+        self._previous_fingerprints: List[str] = []
+        self._cache_name: Optional[str] = None
+        self._cache_fingerprints: List[str] = []
+        self._cache_tokens = 0
+        self._cache_expires_at = 0.0
+
+    def _debug(self, message: str):
+        if self.logger:
+            from logger import log_debug
+            log_debug(self.logger, message)
+
+    def _drop_cache(self):
+        """Forget (and delete on the provider side) the active cached prefix."""
+        if self._cache_name:
+            try:
+                self.provider.delete(self._cache_name)
+            except Exception:
+                pass  # Provider will expire it anyway
+        self._cache_name = None
+        self._cache_fingerprints = []
+        self._cache_tokens = 0
+
+    def _register(self, prefix: List[BaseMessage], fingerprints: List[str], prefix_tokens: int) -> bool:
+        """Register a new cached prefix, replacing the active one."""
+        self._drop_cache()
+        try:
+            self._cache_name = self.provider.create(prefix, self.ttl_seconds)
+        except Exception as e:
+            self._debug(f"Context cache registration failed: {e}")
+            return False
+        self._cache_fingerprints = fingerprints
+        self._cache_tokens = prefix_tokens
+        # Renew a little before the provider expires it
+        self._cache_expires_at = time.monotonic() + self.ttl_seconds * 0.9
+        self._debug(f"Registered cached prefix {self._cache_name} ({len(prefix)} messages, ~{prefix_tokens} tokens)")
+        return True
+
+    def invoke(self, messages: List[BaseMessage]) -> Tuple[object, int]:
+        """
+        Invoke the LLM, reusing a cached prefix when possible.
+
+        Args:
+            messages: Full list of messages for this turn (system prompt first)
+
+        Returns:
+            Tuple of (response, cached_input_tokens)
+        """
+        if self.provider is None:
+            return self.llm.invoke(messages), 0
+
+        fingerprints = [_fingerprint(m) for m in messages]
+        previous_fingerprints = self._previous_fingerprints
+        self._previous_fingerprints = fingerprints
+
+        # The stable prefix is what this request shares with the previous one,
+        # always leaving at least the newest message in the delta
+        stable_length = min(_common_prefix_length(previous_fingerprints, fingerprints), len(messages) - 1)
+
+        cached_length = len(self._cache_fingerprints)
+        cache_usable = (
+            self._cache_name is not None
+            and cached_length < len(messages)
+            and fingerprints[:cached_length] == self._cache_fingerprints
+            and time.monotonic() < self._cache_expires_at
+        )
+
+        if cache_usable and stable_length > cached_length:
+            # Refresh once enough stable history has piled up outside the cache
+            uncached_tokens = estimate_tokens_from_messages(messages[cached_length:stable_length])
+            if uncached_tokens >= self.refresh_tokens:
+                cache_usable = False
+
+        if not cache_usable and stable_length > 0:
+            prefix = messages[:stable_length]
+            prefix_tokens = estimate_tokens_from_messages(prefix)
+            if prefix_tokens >= self.min_prefix_tokens:
+                cache_usable = self._register(prefix, fingerprints[:stable_length], prefix_tokens)
+
+        if cache_usable:
+            delta = messages[len(self._cache_fingerprints):]
+            try:
+                response = self.provider.invoke(self.llm, self._cache_name, delta)
+                record_cache_event('context', hit=True)
+                return response, self._cache_tokens
+            except CachedContentNotFound:
+                self._debug(f"Cached prefix {self._cache_name} expired, sending full context")
+                self._drop_cache()
+
+        record_cache_event('context', hit=False)
+        return self.llm.invoke(messages), 0
+
+
+def compare_long_session(llm, turns: int = 40, user_message_chars: int = 400,
+                         prefill_seconds_per_token: float = 0.00002,
+                         max_remember_messages: int = 40, block_size: int = 20,
+                         system_prompt: str = "You are a helpful and friendly assistant. Answer questions clearly and concisely.") -> Dict[str, Dict[str, float]]:
+    """
+    Compare cost and modelled latency of a long session with and without context caching.
+
+    Runs the same conversation, sent agent-2 style (a block window of the
+    history plus the new message), against `llm` twice: once with plain invokes and once through a ContextCache
+    backed by LocalCachedContentProvider. Latency is modelled as measured wall
+    time plus prefill time for uncached input tokens, since the local stand-in
+    can't skip the prefill a real provider skips.
+
+    Args:
+        llm: Chat model to use (a fake model is fine)
+        turns: Number of conversation turns
+        user_message_chars: Size of each simulated user message
+        prefill_seconds_per_token: Modelled prefill time per uncached input token
+        max_remember_messages: Maximum number of history messages sent (agent-2's window)
+        block_size: Number of messages the window start advances by at a time
+        system_prompt: System prompt text
+
+    Returns:
+        Dictionary keyed by 'uncached' and 'cached' with totals for
+        'input_tokens', 'cached_input_tokens', 'cost', and 'latency'
+    """
+    from tokens_counter import get_token_counts_with_cost
+
+    results = {}
+    for mode in ('uncached', 'cached'):
+        provider = LocalCachedContentProvider() if mode == 'cached' else None
+        context_cache = ContextCache(llm, provider)
+        history: List[BaseMessage] = []
+        totals = {'input_tokens': 0, 'cached_input_tokens': 0, 'cost': 0.0, 'latency': 0.0}
+
+        for turn in range(turns):
+            user_message = HumanMessage(content=f"Turn {turn}: " + "x" * user_message_chars)
+            window = get_block_window(history, max_remember_messages, block_size)
+            messages = [SystemMessage(content=system_prompt)] + window + [user_message]
+
+            start_time = time.time()
+            response, cached_tokens = context_cache.invoke(messages)
+            elapsed_time = time.time() - start_time
+
+            token_data = get_token_counts_with_cost(llm, messages, response, cached_tokens)
+            uncached_tokens = token_data['input_tokens'] - token_data['cached_input_tokens']
+            totals['input_tokens'] += token_data['input_tokens']
+            totals['cached_input_tokens'] += token_data['cached_input_tokens']
+            totals['cost'] += token_data['cost']
+            totals['latency'] += elapsed_time + uncached_tokens * prefill_seconds_per_token
+
+            history.extend([user_message, AIMessage(content=response.content)])
+
+        results[mode] = totals
+
+    return results
+
+
+if __name__ == "__main__":
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    fake_llm = FakeListChatModel(responses=["Sure, here is a detailed answer. " * 20])
+    comparison = compare_long_session(fake_llm)
+    for mode, totals in comparison.items():
+        print(
+            f"{mode:>9}: input={totals['input_tokens']} cached={totals['cached_input_tokens']} "
+            f"cost=${totals['cost']:.6f} latency={totals['latency']:.2f}s"
+        )
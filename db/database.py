@@ -2,6 +2,8 @@ import sqlite3
 from datetime import datetime
 from typing import Optional, List
 
+from metrics import DB_LATENCY, record_token_usage
+
 DATABASE_PATH = 'db/sqlite.db'
 
 # Create the table if it doesn't exist
@@ -15,10 +17,13 @@ def create_table():
             response TEXT,
             input_tokens INTEGER DEFAULT 0,
             output_tokens INTEGER DEFAULT 0,
+            cached_input_tokens INTEGER DEFAULT 0,
             cost REAL DEFAULT 0.0,
             cost_formatted TEXT DEFAULT '$0.000000',
+            shared_by INTEGER DEFAULT 1,
             agent_type TEXT DEFAULT 'agent1',
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            selected_response TEXT
         )
     ''')
     # Add new columns if table exists without them (migration)
@@ -30,6 +35,10 @@ def create_table():
         cursor.execute('ALTER TABLE messages ADD COLUMN output_tokens INTEGER DEFAULT 0')
     except sqlite3.OperationalError:
         pass  # Column already exists
+    try:
+        cursor.execute('ALTER TABLE messages ADD COLUMN cached_input_tokens INTEGER DEFAULT 0')
+    except sqlite3.OperationalError:
+        pass  # Column already exists
     try:
         cursor.execute('ALTER TABLE messages ADD COLUMN cost REAL DEFAULT 0.0')
     except sqlite3.OperationalError:
@@ -38,6 +47,10 @@ def create_table():
         cursor.execute('ALTER TABLE messages ADD COLUMN cost_formatted TEXT DEFAULT \'$0.000000\'')
     except sqlite3.OperationalError:
         pass  # Column already exists
+    try:
+        cursor.execute('ALTER TABLE messages ADD COLUMN shared_by INTEGER DEFAULT 1')
+    except sqlite3.OperationalError:
+        pass  # Column already exists
     try:
         cursor.execute('ALTER TABLE messages ADD COLUMN agent_type TEXT DEFAULT \'agent1\'')
     except sqlite3.OperationalError:
@@ -46,31 +59,42 @@ def create_table():
         cursor.execute('ALTER TABLE messages ADD COLUMN created_at TEXT DEFAULT CURRENT_TIMESTAMP')
     except sqlite3.OperationalError:
         pass  # Column already exists
+    try:
+        cursor.execute('ALTER TABLE messages ADD COLUMN selected_response TEXT')
+        # Existing rows were all shown to the user
+        cursor.execute('UPDATE messages SET selected_response = response')
+    except sqlite3.OperationalError:
+        pass  # Column already exists
     conn.commit()
     conn.close()
 
 # Add a message to the database
 def add_message(message: str, response_text: str, agent_type: str = 'agent1', 
-                llm=None, messages: Optional[List] = None, response_obj=None):
+                llm=None, messages: Optional[List] = None, response_obj=None,
+                cached_input_tokens: int = 0, selected_response: Optional[str] = None):
     """
     Add a message to the database with automatic token, cost, and datetime calculation.
     
     Args:
         message: User message text (input)
         response_text: Bot response text (output)
-        agent_type: Type of agent ('agent1' or 'agent2'), defaults to 'agent1'
+        agent_type: Type of agent ('agent1', 'agent2', or an agent-3 branch), defaults to 'agent1'
         llm: LLM instance (optional, for token calculation)
         messages: List of messages sent to LLM (optional, for token calculation)
         response_obj: Response object from LLM (optional, for token calculation)
+        cached_input_tokens: Input tokens served from a cached context (optional, billed at the discounted rate)
+        selected_response: Answer shown to the user, if already known (optional, see set_selected_response)
     
     The function automatically handles:
     - Datetime (created_at) - set to current time
     - Token counting (if llm, messages, and response_obj are provided)
     - Cost calculation (if tokens are calculated)
+    - Token and cost splitting for responses shared by coalesced requests (shared_by)
+
+    Returns:
+        Dictionary with 'message_id', 'input_tokens', 'output_tokens', 'cached_input_tokens',
+        'shared_by', 'cost', and 'cost_formatted' as saved
     """
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
     # Get current datetime in ISO format (handled automatically)
     current_datetime = datetime.now().isoformat()
     
@@ -79,31 +103,86 @@ def add_message(message: str, response_text: str, agent_type: str = 'agent1',
     output_tokens = 0
     cost = 0.0
     cost_formatted = '$0.000000'
+    shared_by = 1
     
     if llm and messages and response_obj:
         try:
             from tokens_counter import get_token_counts_with_cost
-            token_data = get_token_counts_with_cost(llm, messages, response_obj)
+            token_data = get_token_counts_with_cost(llm, messages, response_obj, cached_input_tokens)
             input_tokens = token_data['input_tokens']
             output_tokens = token_data['output_tokens']
+            cached_input_tokens = token_data['cached_input_tokens']
             cost = token_data['cost']
             cost_formatted = token_data['cost_formatted']
+            shared_by = token_data['shared_by']
+            record_token_usage(token_data)
         except Exception:
             # If token calculation fails, use defaults
             pass
     
-    cursor.execute('''
-        INSERT INTO messages (message, response, input_tokens, output_tokens, cost, cost_formatted, agent_type, created_at) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (message, response_text, input_tokens, output_tokens, cost, cost_formatted, agent_type, current_datetime))
-    conn.commit()   
-    conn.close()
+    with DB_LATENCY.time():
+        conn = sqlite3.connect(DATABASE_PATH)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO messages (message, response, input_tokens, output_tokens, cached_input_tokens, cost, cost_formatted, shared_by, agent_type, created_at, selected_response)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (message, response_text, input_tokens, output_tokens, cached_input_tokens, cost, cost_formatted, shared_by, agent_type, current_datetime, selected_response))
+        message_id = cursor.lastrowid
+        conn.commit()   
+        conn.close()
 
-# Get last messages from the database
-def get_last_messages(limit: int=25):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''SELECT * FROM messages ORDER BY id DESC LIMIT ?''', (limit,))
-    messages = cursor.fetchall()
-    conn.close()
-    return messages
\ No newline at end of file
+    return {
+        'message_id': message_id,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cached_input_tokens': cached_input_tokens,
+        'shared_by': shared_by,
+        'cost': cost,
+        'cost_formatted': cost_formatted
+    }
+
+# Get last messages from the database (optionally only those of one agent_type)
+def get_last_messages(limit: int=25, agent_type: Optional[str] = None):
+    with DB_LATENCY.time():
+        conn = sqlite3.connect(DATABASE_PATH)
+        cursor = conn.cursor()
+        if agent_type is None:
+            cursor.execute('''SELECT * FROM messages ORDER BY id DESC LIMIT ?''', (limit,))
+        else:
+            cursor.execute('''SELECT * FROM messages WHERE agent_type = ? ORDER BY id DESC LIMIT ?''', (agent_type, limit))
+        messages = cursor.fetchall()
+        conn.close()
+    return messages
+
+# Set the answer shown to the user for a saved message (makes it part of the conversation history)
+def set_selected_response(message_id: int, selected_response: str):
+    with DB_LATENCY.time():
+        conn = sqlite3.connect(DATABASE_PATH)
+        cursor = conn.cursor()
+        cursor.execute('''UPDATE messages SET selected_response = ? WHERE id = ?''', (selected_response, message_id))
+        conn.commit()
+        conn.close()
+
+# Get the last conversation turns of one agent_type as (id, message, selected_response) tuples
+def get_last_selected_messages(limit: int, agent_type: str):
+    with DB_LATENCY.time():
+        conn = sqlite3.connect(DATABASE_PATH)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, message, selected_response FROM messages
+            WHERE agent_type = ? AND selected_response IS NOT NULL
+            ORDER BY id DESC LIMIT ?
+        ''', (agent_type, limit))
+        messages = cursor.fetchall()
+        conn.close()
+    return messages
+
+# Count the conversation turns of one agent_type
+def count_selected_messages(agent_type: str) -> int:
+    with DB_LATENCY.time():
+        conn = sqlite3.connect(DATABASE_PATH)
+        cursor = conn.cursor()
+        cursor.execute('''SELECT COUNT(*) FROM messages WHERE agent_type = ? AND selected_response IS NOT NULL''', (agent_type,))
+        count = cursor.fetchone()[0]
+        conn.close()
+    return count
\ No newline at end of file
@@ -58,7 +58,7 @@ def format_error_message(error: Exception) -> str:
         return error_title
 
 
-def handle_error(error: Exception, logger, elapsed_time: float) -> bool:
+def handle_error(error: Exception, logger, elapsed_time: float, count_error: bool = True) -> bool:
     """
     Handle error: log it and return True if chat should close.
     
@@ -66,15 +66,19 @@ def handle_error(error: Exception, logger, elapsed_time: float) -> bool:
         error: Exception object
         logger: Logger instance
         elapsed_time: Time elapsed before error
+        count_error: Count the error in the metrics (False if already counted)
     
     Returns:
         True if chat should close, False otherwise
     """
     from logger import log_error, print_error_message
+    from metrics import ERRORS
     
     log_error(logger, error, elapsed_time)
     
     simple_error = format_error_message(error)
+    if count_error:
+        ERRORS.inc(category=simple_error)
     print_error_message(simple_error)
     
     return True  # Close chat on error
@@ -95,3 +99,44 @@ def add_system_prompt_if_needed(messages: List, system_prompt: str) -> List:
         return [SystemMessage(content=system_prompt)] + messages
     return messages
 
+
+def get_block_window(messages: List, max_messages: int, block_size: int) -> List:
+    """
+    Get the most recent messages, advancing the window start in fixed blocks.
+    
+    Unlike a plain "last N" window, the oldest kept message only changes every
+    block_size messages, so the start of the context stays the same between
+    turns (which lets context caching reuse it).
+    
+    Args:
+        messages: List of LangChain messages (oldest first)
+        max_messages: Maximum number of messages to keep
+        block_size: Number of messages the window start advances by at a time
+    
+    Returns:
+        Between max_messages - block_size and max_messages most recent messages
+    """
+    size = get_block_window_size(len(messages), max_messages, block_size)
+    return list(messages[len(messages) - size:])
+
+
+def get_block_window_size(total_messages: int, max_messages: int, block_size: int) -> int:
+    """
+    Get how many of the most recent messages get_block_window keeps.
+
+    Lets callers that store history elsewhere (database, session log) read
+    only the window instead of the whole history.
+
+    Args:
+        total_messages: Number of messages in the history
+        max_messages: Maximum number of messages to keep
+        block_size: Number of messages the window start advances by at a time
+
+    Returns:
+        Number of most recent messages in the window
+    """
+    overflow = total_messages - max_messages
+    if overflow <= 0:
+        return total_messages
+    start = -(-overflow // block_size) * block_size  # Round up to a whole block
+    return total_messages - start
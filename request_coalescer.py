@@ -0,0 +1,112 @@
+# Standard library imports
+import copy
+import hashlib
+import json
+import threading
+from typing import Dict, List
+
+# LangChain imports
+from langchain_core.messages import BaseMessage
+
+# Local imports
+from metrics import LLM_LATENCY, record_cache_event
+
+
+def normalize_context_key(messages: List[BaseMessage], **kwargs) -> str:
+    """
+    Build a key identifying a model call by its normalized context.
+
+    Message contents are compared with surrounding and repeated whitespace
+    collapsed, so prompts that only differ in spacing share a key.
+
+    Args:
+        messages: Messages sent to the LLM
+        **kwargs: Extra invoke arguments (e.g. cached_content), part of the key
+
+    Returns:
+        Hex digest of the normalized context
+    """
+    normalized = [[m.type, " ".join(str(m.content).split())] for m in messages]
+    payload = json.dumps([normalized, sorted((k, str(v)) for k, v in kwargs.items())])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _InFlightCall:
+    """A model call in progress and the callers waiting on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self.waiters = 1
+
+
+class RequestCoalescer:
+    """
+    Single-flight layer around `llm.invoke`.
+
+    Concurrent calls with an identical normalized context share one upstream
+    call; the result is fanned out to every waiter. Each waiter gets its own
+    copy of the response with `response_metadata['shared_by']` set to the
+    number of callers that shared it and `response_metadata['shared_index']`
+    to its position among them (0 for the caller that made the upstream
+    call), which token accounting uses to split tokens and cost. Errors are
+    fanned out the same way.
+
+    Exposes `invoke(messages, **kwargs)` so it can be used anywhere an LLM is.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, _InFlightCall] = {}
+
+    def invoke(self, messages: List[BaseMessage], **kwargs):
+        """
+        Invoke the LLM, joining an identical call already in flight.
+
+        Args:
+            messages: Messages to send to the LLM
+            **kwargs: Extra arguments passed to llm.invoke
+
+        Returns:
+            Response object (a per-caller copy tagged with 'shared_by' and 'shared_index')
+        """
+        key = normalize_context_key(messages, **kwargs)
+
+        with self._lock:
+            call = self._in_flight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self._in_flight[key] = call
+            else:
+                call.waiters += 1
+            shared_index = call.waiters - 1
+        record_cache_event('coalescer', hit=not is_leader)
+
+        if is_leader:
+            try:
+                with LLM_LATENCY.time():
+                    call.response = self.llm.invoke(messages, **kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                # Stop accepting waiters before waking them, so the count is final
+                with self._lock:
+                    del self._in_flight[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+
+        response = copy.copy(call.response)
+        response.response_metadata = {
+            **(call.response.response_metadata or {}),
+            'shared_by': call.waiters,
+            'shared_index': shared_index
+        }
+        return response
+
@@ -0,0 +1,341 @@
+# Standard library imports
+import os
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+# LangChain imports
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+DEFAULT_LOG_PATH = 'db/sessions.log'
+DEFAULT_MAX_MEMORY_BYTES = 32 * 1024 * 1024  # 32 MB of hot history
+DEFAULT_MAX_HOT_MESSAGES = 100  # Most recent messages kept in memory per hot session
+
+# Record header: offset of the session's previous record, role, session id length, content length
+_HEADER = struct.Struct('<QBHI')
+_NO_PREVIOUS = 2 ** 64 - 1
+
+# Role codes stored in the log (a clear record ends a session's history)
+_ROLE_CLEAR = 0
+_ROLE_CODES = {'system': 1, 'human': 2, 'ai': 3}
+_ROLE_CLASSES = {1: SystemMessage, 2: HumanMessage, 3: AIMessage}
+
+# Size of the sequential reads used to replay the log on startup
+_RECOVER_CHUNK_BYTES = 1024 * 1024
+
+# Memory used by one hot message besides its payload (bytes object + list slot)
+_MESSAGE_OVERHEAD_BYTES = sys.getsizeof(b'') + 8
+
+
+def _encode_message(message: BaseMessage) -> bytes:
+    """Encode a message as its compact in-memory payload (role byte + UTF-8 content)."""
+    if message.type not in _ROLE_CODES:
+        raise ValueError(f"Unsupported message type: {message.type}")
+    return bytes([_ROLE_CODES[message.type]]) + str(message.content).encode('utf-8')
+
+
+def _decode_message(payload: bytes) -> BaseMessage:
+    """Decode a compact payload back to a LangChain message."""
+    return _ROLE_CLASSES[payload[0]](content=payload[1:].decode('utf-8'))
+
+
+class SessionStore:
+    """
+    Bounded multi-session chat history with spill-to-disk.
+
+    Every message is appended to a log file as it is added, so the log is
+    always the source of truth and a restart (or crash) replays it. Recently
+    used sessions stay in memory in compact form (encoded bytes), with an LRU
+    across sessions and a cap on their total size; only the last
+    `max_hot_messages` of a session are kept, since agents only send a recent
+    window. Evicted (cold) sessions cost only an offset and a count in memory
+    and are reloaded lazily from the log with positioned reads (nothing is
+    memory-mapped, so reading cold sessions doesn't grow RSS with the log). Each record points to
+    the session's previous record, so reading the last n messages of a
+    session reads only its last n records.
+    """
+
+    def __init__(self, path: str = DEFAULT_LOG_PATH, max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES,
+                 max_hot_messages: int = DEFAULT_MAX_HOT_MESSAGES, fsync: bool = False):
+        """
+        Args:
+            path: Path of the append-only log file
+            max_memory_bytes: Cap on the size of hot (in-memory) sessions
+            max_hot_messages: Most recent messages kept in memory per hot session
+                (older ones are read from the log when asked for)
+            fsync: fsync after every append (durable against power loss, slower)
+        """
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_hot_messages = max_hot_messages
+        self.fsync = fsync
+
+        log_dir = os.path.dirname(path)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+
+        self._lock = threading.RLock()
+        self._file = open(path, 'a+b')
+        self._tails: Dict[str, int] = {}
+        self._counts: Dict[str, int] = {}
+        self._hot: "OrderedDict[str, List[bytes]]" = OrderedDict()
+        self._hot_sizes: Dict[str, int] = {}
+        self._hot_bytes = 0
+
+        self._recover()
+
+    def _read(self, offset: int, length: int) -> bytes:
+        """Read bytes from the log at an offset (the data is not kept mapped or cached by us)."""
+        if hasattr(os, 'pread'):
+            return os.pread(self._file.fileno(), length, offset)
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def _recover(self):
+        """Rebuild the session index by replaying the log, dropping a torn last record."""
+        size = os.fstat(self._file.fileno()).st_size
+        offset = 0
+        # Scan in chunks so replay reads the log sequentially, not record by record
+        chunk, chunk_start = b'', 0
+        while offset + _HEADER.size <= size:
+            if offset + _HEADER.size > chunk_start + len(chunk):
+                chunk, chunk_start = self._read(offset, max(_RECOVER_CHUNK_BYTES, _HEADER.size)), offset
+            _, role, session_length, content_length = _HEADER.unpack_from(chunk, offset - chunk_start)
+            end = offset + _HEADER.size + session_length + content_length
+            if end > size:
+                break
+            start = offset + _HEADER.size
+            if start + session_length > chunk_start + len(chunk):
+                chunk, chunk_start = self._read(offset, max(_RECOVER_CHUNK_BYTES, end - offset)), offset
+            session_id = chunk[start - chunk_start:start - chunk_start + session_length].decode('utf-8')
+            self._tails[session_id] = offset
+            self._counts[session_id] = 0 if role == _ROLE_CLEAR else self._counts.get(session_id, 0) + 1
+            offset = end
+
+        if offset < size:
+            # Crash mid-append: cut the incomplete record
+            self._file.truncate(offset)
+
+    def _append(self, session_id: str, role: int, content: bytes):
+        """Append a record to the log and make it the session's tail."""
+        session_bytes = session_id.encode('utf-8')
+        previous = self._tails.get(session_id, _NO_PREVIOUS)
+        offset = self._file.seek(0, os.SEEK_END)
+        self._file.write(_HEADER.pack(previous, role, len(session_bytes), len(content)) + session_bytes + content)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._tails[session_id] = offset
+        self._counts[session_id] = 0 if role == _ROLE_CLEAR else self._counts.get(session_id, 0) + 1
+
+    def _load(self, session_id: str, limit: int) -> List[bytes]:
+        """Read a session's last `limit` payloads from the log by following its record chain."""
+        offset = self._tails.get(session_id, _NO_PREVIOUS)
+        payloads = []
+        while offset != _NO_PREVIOUS and len(payloads) < limit:
+            previous, role, session_length, content_length = _HEADER.unpack(self._read(offset, _HEADER.size))
+            if role == _ROLE_CLEAR:
+                break
+            start = offset + _HEADER.size + session_length
+            payloads.append(bytes([role]) + self._read(start, content_length))
+            offset = previous
+        payloads.reverse()
+        return payloads
+
+    def _set_hot(self, session_id: str, payloads: List[bytes]):
+        """Load a session's most recent payloads into memory as the most recently used."""
+        if len(payloads) > self.max_hot_messages:
+            payloads = payloads[len(payloads) - self.max_hot_messages:]
+        size = sum(len(p) + _MESSAGE_OVERHEAD_BYTES for p in payloads)
+        self._hot_bytes += size - self._hot_sizes.get(session_id, 0)
+        self._hot[session_id] = payloads
+        self._hot_sizes[session_id] = size
+        self._hot.move_to_end(session_id)
+        self._evict()
+
+    def _evict(self):
+        """Spill least recently used sessions over the memory cap (already on disk, so just drop them)."""
+        while self._hot_bytes > self.max_memory_bytes and len(self._hot) > 1:
+            evicted, _ = self._hot.popitem(last=False)
+            self._hot_bytes -= self._hot_sizes.pop(evicted)
+
+    def add_message(self, session_id: str, message: BaseMessage):
+        """Append a message to a session."""
+        payload = _encode_message(message)
+        with self._lock:
+            self._append(session_id, payload[0], payload[1:])
+            if session_id in self._hot:
+                payloads = self._hot[session_id]
+                payloads.append(payload)
+                size = len(payload) + _MESSAGE_OVERHEAD_BYTES
+                if len(payloads) > self.max_hot_messages:
+                    size -= len(payloads.pop(0)) + _MESSAGE_OVERHEAD_BYTES
+                self._hot_sizes[session_id] += size
+                self._hot_bytes += size
+                self._hot.move_to_end(session_id)
+                self._evict()
+
+    def get_messages(self, session_id: str, last_n: Optional[int] = None) -> List[BaseMessage]:
+        """
+        Return a session's messages, reading them from disk if they aren't hot.
+
+        Args:
+            session_id: Session to read
+            last_n: Only return the last n messages (None for the whole history)
+
+        Returns:
+            Messages, oldest first
+        """
+        with self._lock:
+            count = self._counts.get(session_id, 0)
+            wanted = count if last_n is None else min(last_n, count)
+            payloads = self._hot.get(session_id)
+            if payloads is not None and len(payloads) >= wanted:
+                self._hot.move_to_end(session_id)
+            else:
+                payloads = self._load(session_id, wanted)
+                self._set_hot(session_id, payloads)
+            return [_decode_message(p) for p in payloads[len(payloads) - wanted:]]
+
+    def message_count(self, session_id: str) -> int:
+        """Return the number of messages in a session (without reading them)."""
+        with self._lock:
+            return self._counts.get(session_id, 0)
+
+    def clear(self, session_id: str):
+        """Clear a session's history (recorded in the log)."""
+        with self._lock:
+            self._append(session_id, _ROLE_CLEAR, b'')
+            self._set_hot(session_id, [])
+
+    def sessions(self) -> List[str]:
+        """Return the ids of all known sessions."""
+        with self._lock:
+            return list(self._tails)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of sessions, hot sessions, hot bytes and log size."""
+        with self._lock:
+            return {
+                'sessions': len(self._tails),
+                'hot_sessions': len(self._hot),
+                'hot_bytes': self._hot_bytes,
+                'log_bytes': os.fstat(self._file.fileno()).st_size
+            }
+
+    def history(self, session_id: str) -> "SessionChatMessageHistory":
+        """Return a LangChain chat history view of one session."""
+        return SessionChatMessageHistory(self, session_id)
+
+    def close(self):
+        """Close the log file."""
+        with self._lock:
+            self._file.close()
+
+
+class SessionChatMessageHistory(BaseChatMessageHistory):
+    """Chat message history of one session in a SessionStore (drop-in for InMemoryChatMessageHistory)."""
+
+    def __init__(self, store: SessionStore, session_id: str):
+        self.store = store
+        self.session_id = session_id
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.store.get_messages(self.session_id)
+
+    def last_messages(self, n: int) -> List[BaseMessage]:
+        """Return the last n messages (reads at most n records)."""
+        return self.store.get_messages(self.session_id, last_n=n)
+
+    def message_count(self) -> int:
+        """Return the number of messages in the session."""
+        return self.store.message_count(self.session_id)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.store.add_message(self.session_id, message)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        for message in messages:
+            self.store.add_message(self.session_id, message)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
+
+
+if __name__ == "__main__":
+    # Memory benchmark: thousands of simulated sessions, bounded store vs. unbounded in-memory histories
+    import random
+    import tempfile
+    import time
+
+    def rss_mb() -> Dict[str, float]:
+        """Current resident set size in MB (Linux): total, file-backed and anonymous."""
+        with open('/proc/self/statm') as statm:
+            fields = statm.read().split()
+        page_mb = os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+        resident, file_backed = int(fields[1]) * page_mb, int(fields[2]) * page_mb
+        return {'total': resident, 'file': file_backed, 'anon': resident - file_backed}
+
+    session_count = 5000
+    turns_per_session = 10  # One user + one AI message per turn
+    message_chars = 500
+    window_messages = 40  # agent-2's max_remember_messages
+    rng = random.Random(42)
+
+    # Uniform workload: every session gets exactly turns_per_session turns, interleaved at random
+    schedule = [f"session-{s}" for s in range(session_count) for _ in range(turns_per_session)]
+    rng.shuffle(schedule)
+    checkpoint = len(schedule) // 10
+
+    def simulate(add, get):
+        """Replay the schedule, reading the recent window before each turn like agent-2."""
+        samples = []
+        for i, session_id in enumerate(schedule):
+            get(session_id)
+            add(session_id, HumanMessage(content=f"{i} " + "q" * message_chars))
+            add(session_id, AIMessage(content=f"{i} " + "a" * message_chars))
+            if (i + 1) % checkpoint == 0:
+                samples.append(rss_mb())
+        return samples
+
+    def format_samples(samples, key):
+        return ", ".join(f"{s[key]:.0f}" for s in samples)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_path = os.path.join(tmp_dir, 'sessions.log')
+        store = SessionStore(log_path, max_memory_bytes=8 * 1024 * 1024, max_hot_messages=window_messages)
+
+        start_time = time.time()
+        store_samples = simulate(store.add_message, lambda s: store.get_messages(s, last_n=window_messages))
+        store_time = time.time() - start_time
+        store_stats = store.stats()
+        store.close()
+
+        # Crash recovery: reopen and replay the log
+        start_time = time.time()
+        reopened = SessionStore(log_path, max_memory_bytes=8 * 1024 * 1024)
+        replay_time = time.time() - start_time
+        recovered = reopened.stats()['sessions']
+        sample_messages = len(reopened.get_messages('session-0'))
+        reopened.close()
+
+    baseline: Dict[str, List[BaseMessage]] = {}
+    start_time = time.time()
+    baseline_samples = simulate(lambda s, m: baseline.setdefault(s, []).append(m),
+                                lambda s: list(baseline.get(s, [])[-window_messages:]))
+    baseline_time = time.time() - start_time
+
+    print(f"{session_count} sessions x {turns_per_session * 2} messages of {message_chars} chars "
+          f"({len(schedule)} turns, uniform), RSS in MB every {checkpoint} turns")
+    print(f"SessionStore total RSS: {format_samples(store_samples, 'total')}")
+    print(f"SessionStore anon RSS:  {format_samples(store_samples, 'anon')}")
+    print(f"In-memory total RSS:    {format_samples(baseline_samples, 'total')}")
+    print(f"In-memory anon RSS:     {format_samples(baseline_samples, 'anon')}")
+    print(f"Throughput: SessionStore {len(schedule) / store_time:.0f} turns/s ({store_time:.1f}s, "
+          f"{store_stats['hot_sessions']} hot, log {store_stats['log_bytes'] / 1024 / 1024:.0f} MB), "
+          f"in-memory {len(schedule) / baseline_time:.0f} turns/s ({baseline_time:.1f}s)")
+    print(f"Recovery: replayed {recovered} sessions in {replay_time:.2f}s (session-0 has {sample_messages} messages)")
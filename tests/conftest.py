@@ -0,0 +1,6 @@
+# Standard library imports
+import os
+import sys
+
+# Make the project modules importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
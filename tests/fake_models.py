@@ -0,0 +1,31 @@
+# Standard library imports
+import threading
+import time
+
+# LangChain imports
+from langchain_core.messages import AIMessage
+
+
+class SlowFakeModel:
+    """Fake chat model that answers (or fails) after a delay and counts its calls."""
+
+    def __init__(self, delay: float, answer: str = None, error: Exception = None):
+        """
+        Args:
+            delay: Seconds to wait before answering
+            answer: Fixed answer text (defaults to echoing the last message)
+            error: Exception to raise instead of answering
+        """
+        self.delay = delay
+        self.answer = answer
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return AIMessage(content=self.answer if self.answer is not None else f"Answer to: {messages[-1].content}")
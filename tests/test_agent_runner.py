@@ -0,0 +1,229 @@
+# Standard library imports
+import time
+
+# Third-party imports
+import pytest
+
+# Local imports
+from agent_runner import AgentBranch, DatabaseMemory, SessionMemory, check_strategy, run_turn
+from fake_models import SlowFakeModel
+from metrics import ERRORS
+from session_store import SessionStore
+
+
+def branch(agent_type, model, timeout_seconds=None, memory=None):
+    """Branch that isn't saved to the database."""
+    return AgentBranch(agent_type, model, "You are helpful.", memory=memory, record=False,
+                       timeout_seconds=timeout_seconds)
+
+
+def test_branches_run_concurrently():
+    branches = [branch(f"b{i}", SlowFakeModel(delay=0.3, answer="same")) for i in range(3)]
+
+    start_time = time.time()
+    turn = run_turn(branches, "Hi", strategy='vote')
+    elapsed_time = time.time() - start_time
+
+    assert turn['response'] == "same"
+    assert len(turn['branches']) == 3
+    # About as long as one branch, not the sum of all three
+    assert elapsed_time < 0.6
+
+
+def test_first_good_returns_fastest_answer():
+    branches = [branch('slow', SlowFakeModel(delay=0.5, answer="slow")),
+                branch('fast', SlowFakeModel(delay=0.05, answer="fast"))]
+
+    turn = run_turn(branches, "Hi", strategy='first-good')
+
+    assert turn['agent_type'] == 'fast'
+    assert turn['elapsed_time'] < 0.4
+
+
+def test_slow_branch_times_out_and_is_counted():
+    before = ERRORS.value(category='Timeout')
+    branches = [branch('slow', SlowFakeModel(delay=0.5, answer="slow"), timeout_seconds=0.1),
+                branch('ok', SlowFakeModel(delay=0.05, answer="ok"))]
+
+    turn = run_turn(branches, "Hi", strategy='vote')
+
+    assert turn['agent_type'] == 'ok'
+    assert isinstance(turn['branches'][0]['error'], TimeoutError)
+    assert ERRORS.value(category='Timeout') == before + 1
+
+
+def test_vote_picks_majority_answer():
+    branches = [branch('a', SlowFakeModel(delay=0.01, answer="Paris")),
+                branch('b', SlowFakeModel(delay=0.01, answer="Lyon")),
+                branch('c', SlowFakeModel(delay=0.01, answer=" paris "))]
+
+    turn = run_turn(branches, "Capital of France?", strategy='vote')
+
+    assert turn['agent_type'] == 'a'
+
+
+def test_judge_picks_answer():
+    branches = [branch('a', SlowFakeModel(delay=0.01, answer="Lyon")),
+                branch('b', SlowFakeModel(delay=0.01, answer="Paris"))]
+    judge = SlowFakeModel(delay=0.01, answer="2")
+
+    turn = run_turn(branches, "Capital of France?", strategy='judge', judge_llm=judge)
+
+    assert turn['agent_type'] == 'b'
+    assert judge.calls == 1
+    # The judge is not a branch of the turn
+    assert [r['agent_type'] for r in turn['branches']] == ['a', 'b']
+
+
+def test_branch_errors_are_counted():
+    before = ERRORS.value(category='Runtime')
+    branches = [branch('broken', SlowFakeModel(delay=0.01, error=RuntimeError("boom"))),
+                branch('ok', SlowFakeModel(delay=0.05, answer="ok"))]
+
+    turn = run_turn(branches, "Hi", strategy='vote')
+
+    assert turn['agent_type'] == 'ok'
+    assert ERRORS.value(category='Runtime') == before + 1
+
+
+def test_all_branches_failing_raises():
+    branches = [branch('a', SlowFakeModel(delay=0.01, error=RuntimeError("a failed"))),
+                branch('b', SlowFakeModel(delay=0.01, error=RuntimeError("b failed")))]
+
+    with pytest.raises(RuntimeError, match="a failed"):
+        run_turn(branches, "Hi")
+
+
+def test_session_memory_saved_only_after_success(tmp_path):
+    store = SessionStore(str(tmp_path / 'sessions.log'))
+    history = store.history('test')
+    memory = SessionMemory(history)
+
+    with pytest.raises(RuntimeError):
+        run_turn([branch('broken', SlowFakeModel(delay=0.01, error=RuntimeError("boom")), memory=memory)], "Hi")
+    assert history.messages == []
+
+    model = SlowFakeModel(delay=0.01)
+    run_turn([branch('ok', model, memory=memory)], "Hi")
+    run_turn([branch('ok', model, memory=memory)], "Again")
+    assert [m.content for m in history.messages] == ["Hi", "Answer to: Hi", "Again", "Answer to: Again"]
+    store.close()
+
+
+def test_database_memory_requires_recording():
+    with pytest.raises(ValueError):
+        branch('agent1', SlowFakeModel(delay=0.01), memory=DatabaseMemory('agent1'))
+
+
+def test_database_memory_only_reads_own_agent_type(tmp_path, monkeypatch):
+    import db.database as database
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'sqlite.db'))
+    database.create_table()
+
+    agent1 = AgentBranch('agent1', SlowFakeModel(delay=0.01), "You are helpful.", memory=DatabaseMemory('agent1'))
+    fan_out = [AgentBranch(f"agent3-{i}", SlowFakeModel(delay=0.01), "You are helpful.") for i in range(2)]
+
+    run_turn([agent1], "Hi")
+    run_turn(fan_out, "Other", strategy='vote')
+
+    assert [m.content for m in agent1.memory.load()] == ["Hi", "Answer to: Hi"]
+
+
+def test_late_branch_never_writes_memory(tmp_path):
+    store = SessionStore(str(tmp_path / 'sessions.log'))
+    slow_memory = SessionMemory(store.history('slow'))
+    branches = [branch('slow', SlowFakeModel(delay=0.5, answer="late"), timeout_seconds=0.1, memory=slow_memory),
+                branch('fast', SlowFakeModel(delay=0.01))]
+
+    run_turn(branches, "q1")
+    run_turn(branches, "q2")
+    time.sleep(0.6)  # Let the late calls finish
+
+    assert [m.content for m in slow_memory.history.messages] == ["q1", "Answer to: q1", "q2", "Answer to: q2"]
+    store.close()
+
+
+def test_selected_answer_is_saved_to_every_branch(tmp_path):
+    store = SessionStore(str(tmp_path / 'sessions.log'))
+    memories = [SessionMemory(store.history(name)) for name in ('a', 'b')]
+    branches = [branch('a', SlowFakeModel(delay=0.3, answer="slow answer"), memory=memories[0]),
+                branch('b', SlowFakeModel(delay=0.01, answer="fast answer"), memory=memories[1])]
+
+    turn = run_turn(branches, "Hi", strategy='first-good')
+
+    assert turn['response'] == "fast answer"
+    for memory in memories:
+        assert [m.content for m in memory.history.messages] == ["Hi", "fast answer"]
+    store.close()
+
+
+def test_database_memory_stores_selected_answer_only(tmp_path, monkeypatch):
+    import db.database as database
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'sqlite.db'))
+    database.create_table()
+
+    slow = AgentBranch('slow', SlowFakeModel(delay=0.3, answer="late"), "You are helpful.",
+                       memory=DatabaseMemory('slow'), timeout_seconds=0.05)
+    loser = AgentBranch('loser', SlowFakeModel(delay=0.05, answer="not shown"), "You are helpful.",
+                        memory=DatabaseMemory('loser'))
+    winner = AgentBranch('winner', SlowFakeModel(delay=0.01, answer="shown"), "You are helpful.",
+                         memory=DatabaseMemory('winner'))
+
+    run_turn([slow, loser, winner], "Hi", strategy='judge', judge_llm=SlowFakeModel(delay=0.01, answer="2"))
+    time.sleep(0.4)  # The late branch still records its usage row
+
+    for memory in (slow.memory, loser.memory, winner.memory):
+        assert [m.content for m in memory.load()] == ["Hi", "shown"]
+    # Usage rows: one per answer (including the late one), plus a history-only row for the timed-out branch
+    assert len(database.get_last_messages(10)) == 4
+
+
+def test_vote_groups_similar_answers():
+    branches = [branch('a', SlowFakeModel(delay=0.01, answer="It is 42.")),
+                branch('b', SlowFakeModel(delay=0.01, answer="Something else entirely")),
+                branch('c', SlowFakeModel(delay=0.01, answer="it's 42")),
+                branch('d', SlowFakeModel(delay=0.01, answer="It is 42!"))]
+
+    turn = run_turn(branches, "What is the answer?", strategy='vote')
+
+    assert turn['agent_type'] == 'a'
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError):
+        check_strategy('majority')
+    with pytest.raises(ValueError):
+        check_strategy('judge')
+
+
+def test_database_memory_block_window(tmp_path, monkeypatch):
+    import db.database as database
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'sqlite.db'))
+    database.create_table()
+    memory = DatabaseMemory('agent1', max_remember_messages=4, block_size=2)
+
+    starts = []
+    for i in range(7):
+        memory.save(f"q{i}", f"a{i}")
+        starts.append(memory.load()[0].content)
+
+    # The window start only moves every block_size rows
+    assert starts == ["q0", "q0", "q0", "q0", "q2", "q2", "q4"]
+
+
+def test_recorded_branch_saves_cached_input_tokens(tmp_path, monkeypatch):
+    import db.database as database
+    from context_cache import ContextCache, LocalCachedContentProvider
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'sqlite.db'))
+    database.create_table()
+
+    model = SlowFakeModel(delay=0.01)
+    agent = AgentBranch('agent1', model, "You are helpful.", memory=DatabaseMemory('agent1', 10, 5),
+                        context_cache=ContextCache(model, LocalCachedContentProvider(), min_prefix_tokens=1))
+    for question in ("First question", "Second question", "Third question"):
+        run_turn([agent], question)
+
+    rows = database.get_last_messages(3, agent_type='agent1')
+    cached_input_tokens = [row[5] for row in reversed(rows)]
+    assert cached_input_tokens[0] == 0
+    assert all(tokens > 0 for tokens in cached_input_tokens[1:])
@@ -0,0 +1,175 @@
+# Standard library imports
+import time
+
+# Third-party imports
+import pytest
+
+# LangChain imports
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+# Local imports
+from context_cache import CachedContentNotFound, ContextCache, LocalCachedContentProvider
+from fake_models import SlowFakeModel
+from helper import get_block_window
+from tokens_counter import (
+    COST_PER_CACHED_INPUT_TOKEN, COST_PER_INPUT_TOKEN, COST_PER_OUTPUT_TOKEN, calculate_cost
+)
+
+# ~100 tokens per message (4 characters per token)
+MESSAGE_CHARS = 400
+
+
+class RecordingProvider(LocalCachedContentProvider):
+    """Local provider that records registered prefixes and the deltas sent with them."""
+
+    def __init__(self, ttl_override: float = None):
+        super().__init__()
+        self.ttl_override = ttl_override
+        self.created = []
+        self.deltas = []
+
+    def create(self, messages, ttl_seconds=300):
+        name = super().create(messages, self.ttl_override if self.ttl_override is not None else ttl_seconds)
+        self.created.append((name, list(messages)))
+        return name
+
+    def invoke(self, llm, name, delta):
+        self.deltas.append(list(delta))
+        return super().invoke(llm, name, delta)
+
+
+def message(cls, label):
+    return cls(content=f"{label} " + "x" * MESSAGE_CHARS)
+
+
+def contents(messages):
+    return [(m.type, m.content) for m in messages]
+
+
+class Conversation:
+    """Agent-2 style conversation: system prompt + block window of the history + new message."""
+
+    def __init__(self, context_cache, max_messages=100, block_size=100):
+        self.context_cache = context_cache
+        self.max_messages = max_messages
+        self.block_size = block_size
+        self.history = []
+
+    def turn(self, label):
+        user_message = message(HumanMessage, label)
+        window = get_block_window(self.history, self.max_messages, self.block_size)
+        messages = [message(SystemMessage, "system")] + window + [user_message]
+        response, cached_tokens = self.context_cache.invoke(messages)
+        self.history.extend([user_message, AIMessage(content=response.content)])
+        return messages, cached_tokens
+
+
+def test_prefix_registered_once_it_reaches_min_prefix_tokens():
+    provider = RecordingProvider()
+    conversation = Conversation(ContextCache(SlowFakeModel(delay=0), provider, min_prefix_tokens=250))
+
+    _, cached_tokens = conversation.turn("q1")
+    assert cached_tokens == 0
+    # Shared prefix is the system prompt + q1 (~200 tokens): still below the minimum
+    _, cached_tokens = conversation.turn("q2")
+    assert cached_tokens == 0 and provider.created == []
+
+    _, cached_tokens = conversation.turn("q3")
+    assert len(provider.created) == 1
+    assert cached_tokens >= 250
+
+
+def test_only_the_delta_is_sent_after_the_prefix():
+    provider = RecordingProvider()
+    conversation = Conversation(ContextCache(SlowFakeModel(delay=0), provider, min_prefix_tokens=100))
+
+    conversation.turn("q1")
+    messages, _ = conversation.turn("q2")
+
+    _, prefix = provider.created[0]
+    assert contents(prefix) == contents(messages[:2])
+    assert contents(provider.deltas[0]) == contents(messages[2:])
+
+
+def test_prefix_refreshed_after_refresh_tokens():
+    provider = RecordingProvider()
+    conversation = Conversation(
+        ContextCache(SlowFakeModel(delay=0), provider, min_prefix_tokens=100, refresh_tokens=400)
+    )
+
+    conversation.turn("q1")
+    conversation.turn("q2")
+    assert len(provider.created) == 1
+
+    # Each turn adds ~200 stable tokens (answer + question) outside the cached prefix
+    conversation.turn("q3")
+    assert len(provider.created) == 1
+    conversation.turn("q4")
+    assert len(provider.created) == 2
+    # The old prefix was deleted and the new one extends it
+    first_name, first_prefix = provider.created[0]
+    _, second_prefix = provider.created[1]
+    assert contents(second_prefix[:len(first_prefix)]) == contents(first_prefix)
+    with pytest.raises(CachedContentNotFound):
+        provider.get(first_name)
+
+
+def test_expired_prefix_falls_back_to_full_context():
+    # The provider expires entries before the ContextCache expects it to
+    provider = RecordingProvider(ttl_override=0.05)
+    model = SlowFakeModel(delay=0)
+    conversation = Conversation(ContextCache(model, provider, min_prefix_tokens=100))
+
+    conversation.turn("q1")
+    conversation.turn("q2")
+    assert len(provider.created) == 1
+    time.sleep(0.1)
+
+    calls_before = model.calls
+    messages, cached_tokens = conversation.turn("q3")
+
+    assert cached_tokens == 0
+    assert model.calls == calls_before + 1
+    assert len(provider.deltas) == 2  # The cached call was attempted, then the full context was sent
+
+
+def test_window_shift_drops_mismatched_prefix():
+    provider = RecordingProvider()
+    conversation = Conversation(ContextCache(SlowFakeModel(delay=0), provider, min_prefix_tokens=100),
+                                max_messages=4, block_size=2)
+
+    conversation.turn("q1")
+    conversation.turn("q2")
+    first_name, _ = provider.created[0]
+
+    # History grows past the window: its start moves from q1 to q2
+    conversation.turn("q3")
+    messages, cached_tokens = conversation.turn("q4")
+
+    assert messages[1].content.startswith("q2")
+    with pytest.raises(CachedContentNotFound):
+        provider.get(first_name)
+    # Only the system prompt is still shared, and it is cached on its own
+    _, prefix = provider.created[-1]
+    assert contents(prefix) == contents(messages[:1])
+    assert contents(provider.deltas[-1]) == contents(messages[1:])
+    assert cached_tokens > 0
+
+
+def test_no_provider_is_a_plain_invoke():
+    model = SlowFakeModel(delay=0)
+    conversation = Conversation(ContextCache(model))
+
+    for label in ("q1", "q2", "q3"):
+        _, cached_tokens = conversation.turn(label)
+        assert cached_tokens == 0
+    assert model.calls == 3
+
+
+def test_cost_of_cached_input_tokens():
+    cost = calculate_cost(1000, 100, cached_input_tokens=400)['cost']
+    expected = 600 * COST_PER_INPUT_TOKEN + 400 * COST_PER_CACHED_INPUT_TOKEN + 100 * COST_PER_OUTPUT_TOKEN
+    assert cost == pytest.approx(expected)
+    assert cost < calculate_cost(1000, 100)['cost']
+    # Cached tokens can't exceed the input tokens
+    assert calculate_cost(100, 0, cached_input_tokens=500)['cost'] == pytest.approx(100 * COST_PER_CACHED_INPUT_TOKEN)
@@ -0,0 +1,50 @@
+# Local imports
+from metrics import MetricsRegistry
+
+
+def parse_families(text):
+    """Map each TYPE'd family name to its type and the sample names that follow it."""
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, metric_type = line.split(' ')
+            current = families[name] = {'type': metric_type, 'samples': set()}
+        elif line and not line.startswith('#'):
+            current['samples'].add(line.split('{')[0].split(' ')[0])
+    return families
+
+
+def test_prometheus_families_match_sample_names():
+    registry = MetricsRegistry(prefix="test")
+    registry.counter('errors', 'Errors by category').inc(category='API Quota Exceeded')
+    registry.gauge('cost_dollars_per_second', 'Cost per second').set(0.5)
+    registry.histogram('latency_seconds', 'Latency').observe(0.3)
+
+    families = parse_families(registry.render_prometheus())
+
+    assert families['test_errors_total'] == {'type': 'counter', 'samples': {'test_errors_total'}}
+    assert families['test_cost_dollars_per_second']['samples'] == {'test_cost_dollars_per_second'}
+    assert families['test_latency_seconds']['samples'] == {
+        'test_latency_seconds_bucket', 'test_latency_seconds_sum', 'test_latency_seconds_count'
+    }
+
+
+def test_counter_labels_are_rendered():
+    registry = MetricsRegistry(prefix="test")
+    registry.counter('errors', 'Errors by category').inc(2, category='API Quota Exceeded')
+
+    text = registry.render_prometheus()
+
+    assert '# HELP test_errors_total Errors by category' in text
+    assert 'test_errors_total{category="API Quota Exceeded"} 2.0' in text
+
+
+def test_histogram_percentiles_are_within_precision():
+    registry = MetricsRegistry(prefix="test")
+    histogram = registry.histogram('latency_seconds', 'Latency')
+    for i in range(1000):
+        histogram.observe(i / 1000.0)
+
+    assert abs(histogram.percentile(50) - 0.5) / 0.5 < 0.02
+    assert abs(histogram.percentile(99) - 0.99) / 0.99 < 0.02
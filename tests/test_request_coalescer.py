@@ -0,0 +1,114 @@
+# Standard library imports
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Third-party imports
+import pytest
+
+# LangChain imports
+from langchain_core.messages import HumanMessage, SystemMessage
+
+# Local imports
+from fake_models import SlowFakeModel
+from metrics import INPUT_TOKENS, record_token_usage
+from request_coalescer import RequestCoalescer
+from tokens_counter import get_token_counts_with_cost
+
+
+def ask_concurrently(coalescer, prompts):
+    """Invoke the coalescer with all prompts at the same time, returning results or exceptions."""
+    barrier = threading.Barrier(len(prompts))
+
+    def ask(prompt):
+        messages = [SystemMessage(content="You are helpful."), HumanMessage(content=prompt)]
+        barrier.wait()
+        try:
+            return coalescer.invoke(messages)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(prompts)) as pool:
+        return list(pool.map(ask, prompts))
+
+
+def test_identical_prompts_share_one_call():
+    model = SlowFakeModel(delay=0.3)
+    coalescer = RequestCoalescer(model)
+    # Whitespace differences still coalesce
+    prompts = ["What is new?" if i % 2 else "What  is new? " for i in range(20)]
+
+    responses = ask_concurrently(coalescer, prompts)
+
+    assert model.calls == 1
+    assert all(r.content == responses[0].content for r in responses)
+    assert all(r.response_metadata['shared_by'] == 20 for r in responses)
+    # Every waiter gets its own copy
+    assert len({id(r) for r in responses}) == 20
+
+
+def test_error_is_fanned_out_to_every_waiter():
+    model = SlowFakeModel(delay=0.3, error=RuntimeError("429 RESOURCE_EXHAUSTED"))
+    coalescer = RequestCoalescer(model)
+
+    results = ask_concurrently(coalescer, ["What is new?"] * 10)
+
+    assert model.calls == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_different_prompts_are_not_coalesced():
+    model = SlowFakeModel(delay=0.2)
+    coalescer = RequestCoalescer(model)
+
+    responses = ask_concurrently(coalescer, ["What is new?", "What is old?"] * 3)
+
+    assert model.calls == 2
+    assert all(r.response_metadata['shared_by'] == 3 for r in responses)
+
+
+def test_sequential_calls_are_not_shared():
+    model = SlowFakeModel(delay=0)
+    coalescer = RequestCoalescer(model)
+    messages = [HumanMessage(content="What is new?")]
+
+    first = coalescer.invoke(messages)
+    second = coalescer.invoke(messages)
+
+    assert model.calls == 2
+    assert first.response_metadata['shared_by'] == 1
+    assert second.response_metadata['shared_by'] == 1
+
+
+def test_shared_cost_is_split_between_waiters():
+    model = SlowFakeModel(delay=0.3, answer="x" * 400)
+    coalescer = RequestCoalescer(model)
+    messages = [HumanMessage(content="y" * 4000)]
+
+    shared = ask_concurrently(coalescer, ["y" * 4000] * 4)[0]
+    alone = RequestCoalescer(model).invoke(messages)
+
+    shared_data = get_token_counts_with_cost(model, messages, shared)
+    alone_data = get_token_counts_with_cost(model, messages, alone)
+    assert shared_data['shared_by'] == 4
+    assert shared_data['cost'] == pytest.approx(alone_data['cost'] / 4)
+
+
+def test_shared_tokens_add_up_to_one_call():
+    model = SlowFakeModel(delay=0.3, answer="x" * 404)
+    coalescer = RequestCoalescer(model)
+    messages = [HumanMessage(content="y" * 4004)]
+
+    shared = ask_concurrently(coalescer, ["y" * 4004] * 3)
+    alone_data = get_token_counts_with_cost(model, messages, RequestCoalescer(model).invoke(messages))
+    shared_data = [get_token_counts_with_cost(model, messages, r) for r in shared]
+
+    assert sorted(r.response_metadata['shared_index'] for r in shared) == [0, 1, 2]
+    # Tokens are split like the cost, so the rows add up to the upstream call once
+    assert sum(d['input_tokens'] for d in shared_data) == alone_data['input_tokens'] == 1001
+    assert sum(d['output_tokens'] for d in shared_data) == alone_data['output_tokens'] == 101
+    assert sum(d['cost'] for d in shared_data) == pytest.approx(alone_data['cost'])
+
+    before = INPUT_TOKENS.snapshot()['sum']
+    for token_data in shared_data:
+        record_token_usage(token_data)
+    assert INPUT_TOKENS.snapshot()['sum'] - before == 1001
@@ -0,0 +1,94 @@
+# LangChain imports
+from langchain_core.messages import AIMessage, HumanMessage
+
+# Local imports
+from helper import get_block_window
+from session_store import SessionStore
+
+
+def test_sessions_survive_reopen_and_eviction(tmp_path):
+    log_path = str(tmp_path / 'sessions.log')
+    store = SessionStore(log_path, max_memory_bytes=200)
+    for i in range(5):
+        for session_id in ('a', 'b', 'c'):
+            store.add_message(session_id, HumanMessage(content=f"{session_id}{i} é"))
+
+    assert [m.content for m in store.get_messages('a')] == [f"a{i} é" for i in range(5)]
+    assert store.stats()['hot_sessions'] == 1
+    store.close()
+
+    reopened = SessionStore(log_path)
+    assert sorted(reopened.sessions()) == ['a', 'b', 'c']
+    assert [m.content for m in reopened.get_messages('c')] == [f"c{i} é" for i in range(5)]
+    reopened.close()
+
+
+def test_clear_and_torn_record_recovery(tmp_path):
+    log_path = str(tmp_path / 'sessions.log')
+    store = SessionStore(log_path)
+    store.add_message('a', HumanMessage(content="before"))
+    store.clear('a')
+    store.add_message('a', AIMessage(content="after"))
+    store.close()
+
+    # Simulate a crash in the middle of an append
+    with open(log_path, 'ab') as log_file:
+        log_file.write(b'\x01\x02\x03')
+
+    reopened = SessionStore(log_path)
+    messages = reopened.get_messages('a')
+    assert [(m.type, m.content) for m in messages] == [('ai', "after")]
+    reopened.add_message('a', HumanMessage(content="next"))
+    assert [m.content for m in reopened.get_messages('a')] == ["after", "next"]
+    reopened.close()
+
+
+def test_block_window_start_is_stable_within_a_block():
+    messages = list(range(50))
+
+    assert get_block_window(messages[:30], 40, 20) == messages[:30]
+    assert get_block_window(messages[:41], 40, 20) == messages[20:41]
+    assert get_block_window(messages[:50], 40, 20) == messages[20:50]
+
+
+def test_tail_read_and_bounded_hot_session(tmp_path):
+    log_path = str(tmp_path / 'sessions.log')
+    store = SessionStore(log_path, max_hot_messages=4)
+    for i in range(10):
+        store.add_message('a', HumanMessage(content=f"m{i}"))
+
+    assert store.message_count('a') == 10
+    assert [m.content for m in store.get_messages('a', last_n=3)] == ["m7", "m8", "m9"]
+    # Asking for more than is hot reads the tail from the log
+    assert [m.content for m in store.get_messages('a', last_n=6)] == [f"m{i}" for i in range(4, 10)]
+    assert len(store.get_messages('a')) == 10
+    # Only the last max_hot_messages stay in memory, also while the session grows
+    store.add_message('a', HumanMessage(content="m10"))
+    assert store.stats()['hot_bytes'] <= 4 * (len("m10") + 1 + 64)
+    assert [m.content for m in store.get_messages('a', last_n=4)] == ["m7", "m8", "m9", "m10"]
+    store.close()
+
+    # After a restart only the tail is read
+    reopened = SessionStore(log_path, max_hot_messages=4)
+    reopened.clear('b')
+    reopened.add_message('b', AIMessage(content="after clear"))
+    assert reopened.message_count('a') == 11 and reopened.message_count('b') == 1
+    assert [m.content for m in reopened.history('a').last_messages(2)] == ["m9", "m10"]
+    assert [m.content for m in reopened.get_messages('b', last_n=5)] == ["after clear"]
+    reopened.close()
+
+
+def test_recovery_across_read_chunks(tmp_path, monkeypatch):
+    import session_store
+    log_path = str(tmp_path / 'sessions.log')
+    store = SessionStore(log_path)
+    for i in range(20):
+        store.add_message(f"session-{i % 3}", HumanMessage(content="x" * i))
+    store.close()
+
+    # Records and session ids straddle the chunk boundaries
+    monkeypatch.setattr(session_store, '_RECOVER_CHUNK_BYTES', 7)
+    reopened = SessionStore(log_path)
+    assert sorted(reopened.sessions()) == ['session-0', 'session-1', 'session-2']
+    assert [m.content for m in reopened.get_messages('session-1')] == ["x" * i for i in range(1, 20, 3)]
+    reopened.close()
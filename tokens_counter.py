@@ -9,6 +9,8 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 # Gemini 2.5 Flash pricing: Input $0.075/1M tokens, Output $0.30/1M tokens
 COST_PER_INPUT_TOKEN = 0.000000075  # $0.075 per 1M tokens
 COST_PER_OUTPUT_TOKEN = 0.0000003   # $0.30 per 1M tokens
+# Cached input tokens (context caching) are billed at 25% of the input rate
+COST_PER_CACHED_INPUT_TOKEN = 0.00000001875  # $0.01875 per 1M tokens
 
 
 def count_tokens_from_response(response) -> Dict[str, int]:
@@ -51,6 +53,80 @@ def count_tokens_from_response(response) -> Dict[str, int]:
     }
 
 
+def count_cached_tokens_from_response(response) -> int:
+    """
+    Extract the number of cached input tokens from LLM response.
+    
+    Args:
+        response: Response object from LLM invoke
+    
+    Returns:
+        Number of input tokens served from a cached context (0 if not reported)
+    """
+    cached_tokens = 0
+    
+    # Gemini format in response metadata
+    if hasattr(response, 'response_metadata'):
+        metadata = response.response_metadata
+        if metadata and 'usage_metadata' in metadata:
+            cached_tokens = metadata['usage_metadata'].get('cached_content_token_count', 0) or 0
+    
+    # LangChain standard usage metadata (dict with input_token_details)
+    usage = getattr(response, 'usage_metadata', None)
+    if isinstance(usage, dict):
+        details = usage.get('input_token_details') or {}
+        cached_tokens = details.get('cache_read', 0) or cached_tokens
+    
+    return cached_tokens
+
+
+def get_shared_by_from_response(response) -> int:
+    """
+    Get the number of requests that shared this response (request coalescing).
+    
+    Args:
+        response: Response object from LLM invoke
+    
+    Returns:
+        Number of callers that shared the upstream call (1 if not shared)
+    """
+    metadata = getattr(response, 'response_metadata', None) or {}
+    return max(int(metadata.get('shared_by', 1) or 1), 1)
+
+
+def get_shared_index_from_response(response) -> int:
+    """
+    Get this request's position among the requests that shared the response.
+
+    Args:
+        response: Response object from LLM invoke
+
+    Returns:
+        Index from 0 (the request that made the upstream call) to shared_by - 1
+    """
+    metadata = getattr(response, 'response_metadata', None) or {}
+    return int(metadata.get('shared_index', 0) or 0)
+
+
+def split_shared_count(total: int, shared_by: int, shared_index: int) -> int:
+    """
+    Get one request's share of a token count split between shared_by requests.
+
+    Shares are whole tokens; the remainder goes to the first requests, so the
+    shares of all requests add up to the total.
+
+    Args:
+        total: Token count of the upstream call
+        shared_by: Number of requests that shared it
+        shared_index: This request's position (0 to shared_by - 1)
+
+    Returns:
+        This request's share of the tokens
+    """
+    share, remainder = divmod(total, shared_by)
+    return share + (1 if shared_index < remainder else 0)
+
+
 def estimate_tokens_from_messages(messages: List[BaseMessage], model: str = "gemini-2.5-flash") -> int:
     """
     Estimate token count from messages (fallback if API doesn't provide).
@@ -101,19 +177,28 @@ def get_token_counts(llm: ChatGoogleGenerativeAI, messages: List[BaseMessage], r
     return token_counts
 
 
-def calculate_cost(input_tokens: int, output_tokens: int) -> Dict[str, Any]:
+def calculate_cost(input_tokens: int, output_tokens: int, cached_input_tokens: int = 0) -> Dict[str, Any]:
     """
     Calculate cost based on token counts.
     
     Args:
-        input_tokens: Number of input tokens
+        input_tokens: Number of input tokens (including cached ones)
         output_tokens: Number of output tokens
+        cached_input_tokens: Part of input_tokens served from a cached context
     
     Returns:
         Dictionary with 'cost' (FLOAT in dollars) and 'cost_formatted' (currency string)
     """
+    # Cached tokens are a subset of input tokens, billed at the discounted rate
+    cached_input_tokens = min(cached_input_tokens, input_tokens)
+    uncached_input_tokens = input_tokens - cached_input_tokens
+    
     # Calculate total cost in dollars
-    total_cost_dollars = (input_tokens * COST_PER_INPUT_TOKEN) + (output_tokens * COST_PER_OUTPUT_TOKEN)
+    total_cost_dollars = (
+        (uncached_input_tokens * COST_PER_INPUT_TOKEN)
+        + (cached_input_tokens * COST_PER_CACHED_INPUT_TOKEN)
+        + (output_tokens * COST_PER_OUTPUT_TOKEN)
+    )
     
     # Format as currency string
     cost_formatted = f"${total_cost_dollars:.6f}"
@@ -124,28 +209,49 @@ def calculate_cost(input_tokens: int, output_tokens: int) -> Dict[str, Any]:
     }
 
 
-def get_token_counts_with_cost(llm: ChatGoogleGenerativeAI, messages: List[BaseMessage], response) -> Dict[str, Any]:
+def get_token_counts_with_cost(llm: ChatGoogleGenerativeAI, messages: List[BaseMessage], response,
+                               cached_input_tokens: int = 0) -> Dict[str, Any]:
     """
     Get token counts and calculate cost.
     
     Args:
         llm: The LLM instance
-        messages: Input messages
+        messages: Input messages (full context, including any cached prefix)
         response: Response from LLM
+        cached_input_tokens: Estimated cached input tokens, used if the response doesn't report them
     
     Returns:
-        Dictionary with 'input_tokens', 'output_tokens', 'cost', and 'cost_formatted'
+        Dictionary with 'input_tokens', 'output_tokens', 'cached_input_tokens', 'shared_by',
+        'cost', and 'cost_formatted'. When the upstream call was shared by several
+        requests (request coalescing), tokens and cost are this request's share, so
+        adding them up over the requests counts the upstream call once.
     """
     # Get token counts
     token_counts = get_token_counts(llm, messages, response)
     
-    # Calculate cost
-    cost_info = calculate_cost(token_counts['input_tokens'], token_counts['output_tokens'])
+    # Prefer the cached token count reported by the provider
+    cached_input_tokens = count_cached_tokens_from_response(response) or cached_input_tokens
+    cached_input_tokens = min(cached_input_tokens, token_counts['input_tokens'])
+    
+    # Split the tokens of a coalesced call between the requests that shared it
+    shared_by = get_shared_by_from_response(response)
+    if shared_by > 1:
+        shared_index = get_shared_index_from_response(response)
+        token_counts = {
+            'input_tokens': split_shared_count(token_counts['input_tokens'], shared_by, shared_index),
+            'output_tokens': split_shared_count(token_counts['output_tokens'], shared_by, shared_index)
+        }
+        cached_input_tokens = split_shared_count(cached_input_tokens, shared_by, shared_index)
+
+    # Calculate cost (of this request's share)
+    cost_info = calculate_cost(token_counts['input_tokens'], token_counts['output_tokens'], cached_input_tokens)
     
     # Combine results
     return {
         'input_tokens': token_counts['input_tokens'],
         'output_tokens': token_counts['output_tokens'],
+        'cached_input_tokens': cached_input_tokens,
+        'shared_by': shared_by,
         'cost': cost_info['cost'],
         'cost_formatted': cost_info['cost_formatted']
     }